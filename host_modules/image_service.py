@@ -5,32 +5,150 @@ This module provides services related to SONiC images, including:
 3) Calculating checksums for images
 """
 
+import contextlib
 import errno
 import hashlib
 import logging
+import mmap
 import os
+import queue
+import re
 import requests
+from requests.adapters import HTTPAdapter
 import stat
 import subprocess
+import sys
 import json
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from host_modules import host_service
 import tempfile
 
+# The blake3 checksum algorithm is only offered when the optional blake3
+# package is installed.
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
 MOD_NAME = "image_service"
 
 DEFAULT_IMAGE_SAVE_AS = "/tmp/downloaded-sonic.bin"
 
+# Mount point of the partition holding the installed images and boot config.
+HOST_PATH = "/host"
+
+# Files under HOST_PATH holding the boot configuration that sonic-installer list reports: the
+# GRUB environment and menu, and the Aboot boot-config. They are rewritten in place, so their
+# own mtimes change but not the mtime of their directory.
+BOOT_CONFIG_FILES = ("grub/grubenv", "grub/grub.cfg", "boot-config")
+
+# Matches the "Current:", "Next:" and "Available:" lines of sonic-installer list.
+_LIST_LINE_RE = re.compile(r"^\s*(current|next|available)\s*:\s*(.*)$", re.IGNORECASE)
+
+# Chunk size used when streaming a downloaded image to disk. Small chunks make
+# the per-chunk Python overhead in requests/urllib3 the bottleneck.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Images are downloaded to a hidden temporary file in the destination
+# directory, so that moving them into place is an atomic same-filesystem rename.
+DOWNLOAD_TEMP_PREFIX = ".sonic-dl-"
+
+# Images at least this large are fetched with concurrent HTTP range requests
+# when the server supports them, one range per worker.
+PARALLEL_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024
+PARALLEL_DOWNLOAD_WORKERS = 4
+
+# Number of download/checksum DBus calls that are served concurrently.
+TRANSFER_WORKERS = 4
+
+# Idle DOWNLOAD_CHUNK_SIZE read buffers kept for reuse by later downloads,
+# enough for one parallel download without holding on to much memory.
+_BUFFER_POOL = queue.LifoQueue(maxsize=PARALLEL_DOWNLOAD_WORKERS)
+
+# Session shared by all downloads, so that keep-alive connections (and their
+# TCP/TLS handshakes) are reused across requests and DBus calls.
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+# Images are read straight into fixed-size buffers, and each range of a
+# parallel download is written as-is, so ask for the body without any
+# Content-Encoding.
+_SESSION.headers["Accept-Encoding"] = "identity"
+
+# Read buffer used when hashing image files. SONiC images are several hundred
+# MB to a few GB, so a large buffer keeps the number of read() syscalls and
+# Python-level update() calls low.
+CHECKSUM_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Computed digests are cached in extended attributes of the image file, one
+# attribute per algorithm, e.g. "trusted.image_service.sha256". The value is
+# "<size>:<mtime_ns>:<hexdigest>", which catches files changed by normal
+# writes. Whoever can write a file can also put its mtime back after changing
+# it, though, so the cache is only used for files that nobody but the service
+# itself (root) can write, and it lives in trusted.* xattrs, which need
+# CAP_SYS_ADMIN to be written.
+CHECKSUM_XATTR_PREFIX = "trusted.image_service."
+
+# Leaf size for the "<algorithm>-tree" checksums. Leaves are hashed in
+# parallel and the tree digest is the hash of the concatenated leaf digests.
+# The leaf size is fixed so that the digest does not depend on the CPU count.
+TREE_HASH_LEAF_SIZE = 64 * 1024 * 1024
+
 logger = logging.getLogger(__name__)
 
 
 class ImageService(host_service.HostModule):
     """DBus endpoint that handles downloading and installing SONiC images"""
 
+    def __init__(self, mod_name):
+        super().__init__(mod_name)
+        # (cache key, {version: JSON result}) of the last successful list_images call.
+        self._list_cache = None
+        # Number of running sonic-installer commands that change the image list, and how many have
+        # been started; list_images results are only cached if neither changed while listing.
+        self._installer_lock = threading.Lock()
+        self._installer_running = 0
+        self._installer_generation = 0
+        # Downloads and checksums run concurrently; sonic-installer runs one at a time.
+        self.transfer_executor = ThreadPoolExecutor(max_workers=TRANSFER_WORKERS)
+        self.installer_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _dispatch(self, executor, func, args, reply_handler, error_handler):
+        """
+        Run the implementation of a DBus method.
+
+        When called over DBus, func runs on the executor and its result is sent from there
+        through reply_handler/error_handler, so a long download or install doesn't block the
+        main loop and the other methods. Direct Python callers get the result returned.
+
+        Args:
+            executor: ThreadPoolExecutor to run func on.
+            func: implementation of the method, returning an (int, str) tuple.
+            args: arguments for func.
+            reply_handler: DBus reply callback, None when not called over DBus.
+            error_handler: DBus error callback, None when not called over DBus.
+        """
+        if reply_handler is None:
+            return func(*args)
+
+        def send_reply(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error("{} failed: {}".format(func.__name__, e))
+                error_handler(e)
+            else:
+                reply_handler(*result)
+
+        executor.submit(func, *args).add_done_callback(send_reply)
+
     @host_service.method(
-        host_service.bus_name(MOD_NAME), in_signature="ss", out_signature="is"
+        host_service.bus_name(MOD_NAME), in_signature="ss", out_signature="is",
+        async_callbacks=("reply_handler", "error_handler"),
     )
-    def download(self, image_url, save_as):
+    def download(self, image_url, save_as, reply_handler=None, error_handler=None):
         """
         Download a SONiC image.
 
@@ -38,103 +156,560 @@ class ImageService(host_service.HostModule):
              image_url: url for remote image.
              save_as: local path for the downloaded image. The directory must exist and be *all* writable.
         """
+        return self._dispatch(
+            self.transfer_executor, self._download, (image_url, save_as), reply_handler, error_handler
+        )
+
+    @host_service.method(
+        host_service.bus_name(MOD_NAME), in_signature="sss", out_signature="is",
+        async_callbacks=("reply_handler", "error_handler"),
+    )
+    def download_verified(self, image_url, save_as, expected_sha256, reply_handler=None, error_handler=None):
+        """
+        Download a SONiC image and verify its sha256 checksum.
+
+        The checksum is computed while the image is being downloaded, so no
+        second pass over the file is needed. On mismatch the image is discarded.
+
+        Args:
+             image_url: url for remote image.
+             save_as: local path for the downloaded image. The directory must exist and be *all* writable.
+             expected_sha256: expected sha256 hex digest of the image.
+        """
+        return self._dispatch(
+            self.transfer_executor, self._download, (image_url, save_as, expected_sha256),
+            reply_handler, error_handler
+        )
+
+    def _download(self, image_url, save_as, expected_sha256=""):
+        """
+        Download a SONiC image, computing its sha256 checksum on the fly.
+
+        The checksum is cached in the image's xattrs so that a following
+        checksum() call does not have to read the image again.
+
+        Args:
+             image_url: url for remote image.
+             save_as: local path for the downloaded image.
+             expected_sha256: if not empty, the download fails unless the image matches this sha256 hex digest.
+        """
         logger.info("Download new sonic image from {} as {}".format(image_url, save_as))
         # Check if the directory exists, is absolute and has write permission.
         if not os.path.isabs(save_as):
             logger.error("The path {} is not an absolute path".format(save_as))
             return errno.EINVAL, "Path is not absolute"
         dir = os.path.dirname(save_as)
-        if not os.path.isdir(dir):
+        try:
+            st_mode = os.stat(dir).st_mode
+        except OSError:
+            st_mode = 0
+        if not stat.S_ISDIR(st_mode):
             logger.error("Directory {} does not exist".format(dir))
             return errno.ENOENT, "Directory does not exist"
-        st_mode = os.stat(dir).st_mode
-        if (
-            not (st_mode & stat.S_IWUSR)
-            or not (st_mode & stat.S_IWGRP)
-            or not (st_mode & stat.S_IWOTH)
-        ):
+        all_writable = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        if (st_mode & all_writable) != all_writable:
             logger.error("Directory {} is not all writable {}".format(dir, st_mode))
             return errno.EACCES, "Directory is not all writable"
+        temp_file_path = None
         try:
-            response = requests.get(image_url, stream=True)
-            if response.status_code != 200:
-                logger.error(
-                    "Failed to download image: HTTP status code {}".format(
-                        response.status_code
+            size, validator = self._get_ranged_download(image_url)
+            if size >= PARALLEL_DOWNLOAD_MIN_SIZE:
+                temp_file_path, digest = self._download_ranges(image_url, dir, size, validator)
+
+            if temp_file_path is None:
+                response = _SESSION.get(image_url, stream=True)
+                if response.status_code != 200:
+                    logger.error(
+                        "Failed to download image: HTTP status code {}".format(
+                            response.status_code
+                        )
                     )
-                )
-                return errno.EIO, "HTTP error: {}".format(response.status_code)
-
-            with tempfile.NamedTemporaryFile(dir="/tmp", delete=False) as tmp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    tmp_file.write(chunk)
-                temp_file_path = tmp_file.name
+                    return errno.EIO, "HTTP error: {}".format(response.status_code)
+
+                hash_func = hashlib.sha256()
+                fd, temp_file_path = tempfile.mkstemp(dir=dir, prefix=DOWNLOAD_TEMP_PREFIX)
+                try:
+                    with self._pooled_buffer() as buf:
+                        for chunk in self._read_response(response, buf):
+                            hash_func.update(chunk)
+                            self._write_all(fd, chunk)
+                    os.fsync(fd)
+                    digest = hash_func.hexdigest()
+                    # The rename below keeps both the mtime and the xattrs.
+                    self._set_cached_checksum(fd, "sha256", os.fstat(fd), digest)
+                finally:
+                    os.close(fd)
+            if expected_sha256 and digest != expected_sha256.lower():
+                logger.error("Checksum mismatch for image {}: expected {}, got {}".format(image_url, expected_sha256, digest))
+                return errno.EIO, "Checksum mismatch: expected {}, got {}".format(expected_sha256, digest)
+            # The temporary file is in the same directory, so this is always a plain rename.
             os.replace(temp_file_path, save_as)
+            temp_file_path = None
             return 0, "Download successful"
         except Exception as e:
             logger.error("Failed to write downloaded image to disk: {}".format(e))
             return errno.EIO, str(e)
+        finally:
+            if temp_file_path is not None:
+                try:
+                    os.unlink(temp_file_path)
+                except OSError:
+                    pass
+
+    @contextlib.contextmanager
+    def _pooled_buffer(self):
+        """
+        Check a DOWNLOAD_CHUNK_SIZE read buffer out of the buffer pool, allocating a new one if
+        the pool is empty, and return it to the pool afterwards.
+
+        Yields:
+            A memoryview of the buffer.
+        """
+        try:
+            buf = _BUFFER_POOL.get_nowait()
+        except queue.Empty:
+            buf = bytearray(DOWNLOAD_CHUNK_SIZE)
+        try:
+            yield memoryview(buf)
+        finally:
+            try:
+                _BUFFER_POOL.put_nowait(buf)
+            except queue.Full:
+                pass
+
+    def _read_response(self, response, buf):
+        """
+        Read the body of a streamed response into a reusable buffer.
+
+        Args:
+             response: requests response opened with stream=True.
+             buf: writable memoryview to read into.
+
+        Yields:
+            Views of buf holding the next part of the body; each one is only valid until the next is
+            requested. Bodies the server sent with a Content-Encoding anyway are yielded as decoded
+            chunks instead, since urllib3 1.x readinto() fails when a decoded chunk is larger than buf.
+        """
+        if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+            yield from response.iter_content(chunk_size=len(buf))
+            return
+        response.raw.decode_content = True
+        while True:
+            n = response.raw.readinto(buf)
+            if not n:
+                return
+            yield buf[:n]
+
+    def _write_all(self, fd, data, offset=None):
+        """
+        Write all of data to an unbuffered file descriptor.
+
+        Args:
+             fd: file descriptor to write to.
+             data: bytes-like object to write.
+             offset: file offset to write at with pwrite(), or None to write at the current position.
+        """
+        view = memoryview(data)
+        while view:
+            if offset is None:
+                written = os.write(fd, view)
+            else:
+                written = os.pwrite(fd, view, offset)
+                offset += written
+            view = view[written:]
+
+    def _get_ranged_download(self, image_url):
+        """
+        Check whether the server can serve the image with HTTP range requests.
+
+        Args:
+             image_url: url for remote image.
+
+        Returns:
+            A tuple with the size of the image and the If-Range validator (strong ETag, or
+            Last-Modified date) identifying its current version, or (0, None) if the server does
+            not accept byte ranges or gives no way to tell that the image changed between ranges.
+        """
+        try:
+            response = _SESSION.head(image_url, allow_redirects=True)
+        except requests.RequestException as e:
+            logger.info("HEAD request for {} failed: {}".format(image_url, e))
+            return 0, None
+        if response.status_code != 200 or response.headers.get("Accept-Ranges", "").lower() != "bytes":
+            return 0, None
+        # Weak ETags can't be used in If-Range.
+        validator = response.headers.get("ETag", "")
+        if not validator or validator.startswith("W/"):
+            validator = response.headers.get("Last-Modified", "")
+        if not validator:
+            return 0, None
+        try:
+            return int(response.headers.get("Content-Length", 0)), validator
+        except ValueError:
+            return 0, None
+
+    def _download_ranges(self, image_url, dir, size, validator):
+        """
+        Download an image with PARALLEL_DOWNLOAD_WORKERS concurrent range requests, each writing
+        its part of the image at the matching offset of a pre-sized temporary file.
+
+        Every request carries If-Range, so that the server sends the whole image instead of the
+        range if the image changed since the HEAD request, and the parts can't come from
+        different versions of the image.
+
+        Args:
+             image_url: url for remote image.
+             dir: directory in which to create the temporary file.
+             size: size of the image in bytes.
+             validator: ETag or Last-Modified date of the image, from the HEAD request.
+
+        Returns:
+            A tuple with the path of the temporary file and its sha256 hex digest, or (None, None)
+            if the server did not serve the range requests.
+        """
+        part_size = -(-size // PARALLEL_DOWNLOAD_WORKERS)
+
+        def fetch_range(start):
+            end = min(start + part_size, size) - 1
+            response = _SESSION.get(
+                image_url,
+                headers={"Range": "bytes={}-{}".format(start, end), "If-Range": validator},
+                stream=True,
+            )
+            if response.status_code != 206:
+                # The server sent the whole image instead of the range, because it changed or
+                # ignores ranges, or rejected range requests (e.g. 403/416 from signed URLs)
+                # despite advertising them.
+                logger.info("Range request for {} returned HTTP status code {}".format(
+                    image_url, response.status_code))
+                response.close()
+                return False
+            content_range = response.headers.get("Content-Range", "")
+            if content_range != "bytes {}-{}/{}".format(start, end, size):
+                logger.info("Range request for {} bytes {}-{} returned Content-Range {}".format(
+                    image_url, start, end, content_range))
+                response.close()
+                return False
+            if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+                # An encoded range can't be decoded on its own.
+                response.close()
+                return False
+            offset = start
+            with self._pooled_buffer() as buf:
+                for chunk in self._read_response(response, buf):
+                    self._write_all(fd, chunk, offset)
+                    offset += len(chunk)
+            if offset != end + 1:
+                raise IOError("Incomplete download of range {}-{}".format(start, end))
+            return True
+
+        logger.info("Downloading {} bytes from {} with {} parallel range requests".format(
+            size, image_url, PARALLEL_DOWNLOAD_WORKERS))
+        fd, temp_file_path = tempfile.mkstemp(dir=dir, prefix=DOWNLOAD_TEMP_PREFIX)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=PARALLEL_DOWNLOAD_WORKERS) as executor:
+                ranges_served = all(executor.map(fetch_range, range(0, size, part_size)))
+            if ranges_served:
+                os.fsync(fd)
+        except Exception:
+            os.unlink(temp_file_path)
+            raise
+        finally:
+            os.close(fd)
+        if not ranges_served:
+            logger.info("Server did not serve range requests for {}, falling back to a single stream".format(image_url))
+            os.unlink(temp_file_path)
+            return None, None
+
+        # The parts arrive out of order, so hash the file once it is complete;
+        # it is still in the page cache at this point. Keep it there, as the
+        # single-stream download does.
+        digest = self._hash_file(temp_file_path, hashlib.sha256, keep_cached=True)
+        self._set_cached_checksum(temp_file_path, "sha256", os.stat(temp_file_path), digest)
+        return temp_file_path, digest
 
     @host_service.method(
-        host_service.bus_name(MOD_NAME), in_signature="s", out_signature="is"
+        host_service.bus_name(MOD_NAME), in_signature="s", out_signature="is",
+        async_callbacks=("reply_handler", "error_handler"),
     )
-    def install(self, where):
+    def install(self, where, reply_handler=None, error_handler=None):
         """
         Install a a sonic image:
 
         Args:
             where: either a local path or a remote url pointing to the image.
         """
+        return self._dispatch(self.installer_executor, self._install, (where,), reply_handler, error_handler)
+
+    def _install(self, where):
+        """
+        Install a sonic image with sonic-installer, see install().
+        """
         logger.info("Using sonic-installer to install the image at {}.".format(where))
         cmd = ["/usr/local/bin/sonic-installer", "install", "-y", where]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        msg = ""
-        if result.returncode:
-            lines = result.stderr.decode().split("\n")
-            for line in lines:
-                if "Error" in line:
-                    msg = line
-                    break
-        return result.returncode, msg
+        with self._changing_images():
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+            )
+            error_line = ""
+            # Keep draining stderr after the first error so the installer never
+            # blocks on a full pipe.
+            for line in proc.stderr:
+                if not error_line and "Error" in line:
+                    error_line = line.strip()
+            proc.stderr.close()
+            returncode = proc.wait()
+        msg = error_line if returncode else ""
+        return returncode, msg
+
+    @contextlib.contextmanager
+    def _changing_images(self):
+        """
+        Mark a sonic-installer command that changes the image list or boot configuration as
+        running, and drop the cached list_images result once it is done.
+        """
+        with self._installer_lock:
+            self._installer_running += 1
+            self._installer_generation += 1
+        try:
+            yield
+        finally:
+            with self._installer_lock:
+                self._list_cache = None
+                self._installer_running -= 1
+
+    def _installer_state(self):
+        """
+        Returns:
+            The number of sonic-installer commands started so far that change the image list, or
+            None while one of them is running.
+        """
+        with self._installer_lock:
+            return None if self._installer_running else self._installer_generation
 
     @host_service.method(
-        host_service.bus_name(MOD_NAME), in_signature="ss", out_signature="is"
+        host_service.bus_name(MOD_NAME), in_signature="ss", out_signature="is",
+        async_callbacks=("reply_handler", "error_handler"),
     )
-    def checksum(self, file_path, algorithm):
+    def checksum(self, file_path, algorithm, reply_handler=None, error_handler=None):
         """
         Calculate the checksum of a file.
 
         Args:
             file_path: path to the file.
-            algorithm: checksum algorithm to use (sha256, sha512, md5).
+            algorithm: checksum algorithm to use (sha256, sha512, md5, sha256-tree, sha512-tree, blake3).
+                The "-tree" variants hash fixed-size leaves of the file in parallel and return the
+                hash of the concatenated leaf digests; they do not match the plain sha256/sha512 digest.
+                blake3 is only available when the blake3 package is installed.
         """
+        return self._dispatch(
+            self.transfer_executor, self._checksum, (file_path, algorithm), reply_handler, error_handler
+        )
 
+    def _checksum(self, file_path, algorithm):
+        """
+        Calculate the checksum of a file, see checksum().
+        """
         logger.info("Calculating {} checksum for file {}".format(algorithm, file_path))
 
         if not os.path.isfile(file_path):
             logger.error("File {} does not exist".format(file_path))
             return errno.ENOENT, "File does not exist"
 
-        hash_func = None
+        hash_ctor = None
+        tree = False
         if algorithm == "sha256":
-            hash_func = hashlib.sha256()
+            hash_ctor = hashlib.sha256
         elif algorithm == "sha512":
-            hash_func = hashlib.sha512()
+            hash_ctor = hashlib.sha512
         elif algorithm == "md5":
-            hash_func = hashlib.md5()
+            hash_ctor = hashlib.md5
+        elif algorithm == "sha256-tree":
+            hash_ctor = hashlib.sha256
+            tree = True
+        elif algorithm == "sha512-tree":
+            hash_ctor = hashlib.sha512
+            tree = True
+        elif algorithm == "blake3" and blake3 is not None:
+            hash_ctor = blake3.blake3
         else:
             logger.error("Unsupported algorithm: {}".format(algorithm))
             return errno.EINVAL, "Unsupported algorithm"
 
         try:
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_func.update(chunk)
-            return 0, hash_func.hexdigest()
+            st = os.stat(file_path)
+            cached = self._get_cached_checksum(file_path, algorithm, st)
+            if cached:
+                logger.info("Using cached {} checksum for file {}".format(algorithm, file_path))
+                return 0, cached
+
+            if tree:
+                digest = self._tree_hash_file(file_path, hash_ctor, st.st_size)
+            elif algorithm == "blake3" and hasattr(hash_ctor, "update_mmap"):
+                # BLAKE3 is tree-structured itself; update_mmap() hashes the file on all cores.
+                # blake3 releases before 0.4.0 don't have it and are hashed like the others.
+                digest = hash_ctor(max_threads=hash_ctor.AUTO).update_mmap(file_path).hexdigest()
+            else:
+                digest = self._hash_file(file_path, hash_ctor)
+            self._set_cached_checksum(file_path, algorithm, st, digest)
+            return 0, digest
         except Exception as e:
             logger.error("Failed to calculate checksum: {}".format(e))
             return errno.EIO, str(e)
 
+    @host_service.method(
+        host_service.bus_name(MOD_NAME), in_signature="s", out_signature="is"
+    )
+    def quick_checksum(self, file_path):
+        """
+        Calculate a change-detection fingerprint of a file from its path, size and mtime, without
+        reading its content.
+
+        This is NOT an integrity check: a file modified without changing its size and mtime keeps
+        its fingerprint. Use checksum() when the content itself must be verified.
+
+        Args:
+            file_path: path to the file.
+        """
+        logger.info("Calculating quick checksum for file {}".format(file_path))
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            logger.error("File {} does not exist".format(file_path))
+            return errno.ENOENT, "File does not exist"
+        except OSError as e:
+            logger.error("Failed to stat file {}: {}".format(file_path, e))
+            return errno.EIO, str(e)
+        fingerprint = "{}:{}:{}".format(st.st_size, st.st_mtime_ns, file_path)
+        return 0, hashlib.sha256(fingerprint.encode()).hexdigest()
+
+    def _hash_file(self, file_path, hash_ctor, keep_cached=False):
+        """
+        Hash a file sequentially.
+
+        Args:
+            file_path: path to the file.
+            hash_ctor: hashlib constructor of the algorithm to use.
+            keep_cached: leave the pages of the file in the page cache, e.g. for an image that was
+                just downloaded and is normally installed right away.
+
+        Returns:
+            The hex digest of the file.
+        """
+        # hashlib is backed by OpenSSL, which already uses the SHA-NI/ARMv8 SHA
+        # extensions when the CPU has them. Debian's coreutils sha256sum is not
+        # built against OpenSSL and is several times slower, so don't shell out.
+        with open(file_path, "rb") as f:
+            # The image is read once from start to end: ask for aggressive
+            # readahead, and unless it is about to be used, drop its pages
+            # afterwards rather than letting them evict pages other services
+            # still use.
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            if sys.version_info >= (3, 11):
+                # file_digest() runs the read/update loop in C.
+                hash_func = hashlib.file_digest(f, hash_ctor)
+            else:
+                hash_func = hash_ctor()
+                buf = memoryview(bytearray(CHECKSUM_CHUNK_SIZE))
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hash_func.update(buf[:n])
+            if not keep_cached:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        return hash_func.hexdigest()
+
+    def _tree_hash_file(self, file_path, hash_ctor, size):
+        """
+        Hash a file as a one-level tree: every TREE_HASH_LEAF_SIZE leaf is hashed in a worker
+        thread (hashlib releases the GIL while hashing), and the result is the hash of the
+        leaf digests concatenated in file order.
+
+        Args:
+            file_path: path to the file.
+            hash_ctor: hashlib constructor of the algorithm to use.
+            size: size of the file in bytes.
+
+        Returns:
+            The hex tree digest of the file.
+        """
+        root = hash_ctor()
+        if size == 0:
+            # mmap() refuses empty files; an empty file has no leaves.
+            return root.hexdigest()
+
+        with open(file_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm, memoryview(mm) as view:
+                # Every leaf is read sequentially; see _hash_file().
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+
+                def hash_leaf(offset):
+                    with view[offset:offset + TREE_HASH_LEAF_SIZE] as leaf:
+                        return hash_ctor(leaf).digest()
+
+                offsets = range(0, size, TREE_HASH_LEAF_SIZE)
+                workers = min(os.cpu_count() or 1, len(offsets))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for leaf_digest in executor.map(hash_leaf, offsets):
+                        root.update(leaf_digest)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        return root.hexdigest()
+
+    def _checksum_cacheable(self, st):
+        """
+        Check whether the digest of a file may be cached: the file must be owned by the user the
+        service runs as and not be group or world writable, so that nobody else can change its
+        content and then restore its mtime.
+
+        Args:
+            st: os.stat_result of the file.
+        """
+        return st.st_uid == os.geteuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    def _get_cached_checksum(self, file_path, algorithm, st):
+        """
+        Look up a digest previously cached in the extended attributes of a file.
+
+        Args:
+            file_path: path to the file.
+            algorithm: checksum algorithm the digest was computed with.
+            st: os.stat_result of the file.
+
+        Returns:
+            The cached hex digest, or None if there is no valid cache entry.
+        """
+        if not self._checksum_cacheable(st):
+            return None
+        try:
+            value = os.getxattr(file_path, CHECKSUM_XATTR_PREFIX + algorithm).decode()
+        except OSError:
+            # No cached entry, or xattrs are not supported by the filesystem.
+            return None
+        parts = value.split(":")
+        if len(parts) != 3 or parts[0] != str(st.st_size) or parts[1] != str(st.st_mtime_ns):
+            return None
+        return parts[2]
+
+    def _set_cached_checksum(self, file_path, algorithm, st, digest):
+        """
+        Best-effort store of a digest in the extended attributes of a file.
+
+        Args:
+            file_path: path to, or open file descriptor of, the file.
+            algorithm: checksum algorithm the digest was computed with.
+            st: os.stat_result of the file taken before the digest was computed.
+            digest: hex digest to cache.
+        """
+        if not self._checksum_cacheable(st):
+            return
+        value = "{}:{}:{}".format(st.st_size, st.st_mtime_ns, digest)
+        try:
+            os.setxattr(file_path, CHECKSUM_XATTR_PREFIX + algorithm, value.encode())
+        except OSError as e:
+            logger.info("Unable to cache checksum for file {}: {}".format(file_path, e))
+
     @host_service.method(
         host_service.bus_name(MOD_NAME), in_signature="", out_signature="is"
     )
@@ -145,8 +720,35 @@ class ImageService(host_service.HostModule):
         Returns:
             A tuple with an error code and a JSON string with keys "current", "next", and "available" or an error message.
         """
+        return self._list_images(1)
+
+    @host_service.method(
+        host_service.bus_name(MOD_NAME), in_signature="", out_signature="is"
+    )
+    def list_images_v2(self):
+        """
+        List the current, next, and available SONiC images, each image name appearing only once.
+
+        Returns:
+            A tuple with an error code and a JSON string or an error message. The JSON object has
+            "version": 2, the image names in "images", and "current", "next" (-1 if unknown) and
+            "available" as indices into "images".
+        """
+        return self._list_images(2)
+
+    def _list_images(self, version):
+        """
+        List the SONiC images in the JSON format of the given list_images version.
+        """
         logger.info("Listing SONiC images")
 
+        # Don't cache a listing taken while an image is being installed or the next boot image set.
+        installer_state = self._installer_state()
+        key = self._list_images_cache_key() if installer_state is not None else None
+        if key is not None and self._list_cache is not None and self._list_cache[0] == key:
+            logger.info("Using cached list result")
+            return 0, self._list_cache[1][version]
+
         try:
             output = subprocess.check_output(
                 ["/usr/local/bin/sonic-installer", "list"],
@@ -154,34 +756,92 @@ class ImageService(host_service.HostModule):
             ).decode().strip()
             result = self._parse_sonic_installer_list(output)
             logger.info("List result: {}".format(result))
-            return 0, json.dumps(result)
+            images = result["images"]
+            result_json = {
+                1: json.dumps({
+                    "current": images[result["current"]] if result["current"] >= 0 else "",
+                    "next": images[result["next"]] if result["next"] >= 0 else "",
+                    "available": [images[i] for i in result["available"]],
+                }),
+                2: json.dumps(result),
+            }
+            if key is not None and self._installer_state() == installer_state:
+                self._list_cache = (key, result_json)
+            return 0, result_json[version]
         except subprocess.CalledProcessError as e:
             msg = "Failed to list images: command {} failed with return code {} and message {}".format(e.cmd, e.returncode, e.output.decode())
             logger.error(msg)
             return e.returncode, msg
 
+    def _list_images_cache_key(self):
+        """
+        Build the key under which the list_images result is cached.
+
+        sonic-installer list only changes when sonic-installer itself is updated, when an image
+        under /host is added or removed, or when the boot configuration is rewritten, so the key
+        is made of the mtimes of sonic-installer, of the entries of /host and of the
+        BOOT_CONFIG_FILES.
+
+        Returns:
+            The cache key, or None if it can't be computed and the result must not be cached. That
+            is also the case when none of the BOOT_CONFIG_FILES exist, e.g. with U-Boot, which keeps
+            its environment outside of /host.
+        """
+        try:
+            installer_mtime = os.stat("/usr/local/bin/sonic-installer").st_mtime_ns
+            with os.scandir(HOST_PATH) as entries:
+                host_entries = tuple(sorted(
+                    (entry.name, entry.stat(follow_symlinks=False).st_mtime_ns) for entry in entries
+                ))
+            boot_config = []
+            for name in BOOT_CONFIG_FILES:
+                try:
+                    st = os.stat(os.path.join(HOST_PATH, name))
+                except FileNotFoundError:
+                    boot_config.append(None)
+                else:
+                    boot_config.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            return None
+        if not any(boot_config):
+            return None
+        return installer_mtime, host_entries, tuple(boot_config)
+
     @host_service.method(
-        host_service.bus_name(MOD_NAME), in_signature="s", out_signature="is"
+        host_service.bus_name(MOD_NAME), in_signature="s", out_signature="is",
+        async_callbacks=("reply_handler", "error_handler"),
     )
-    def set_next_boot(self, image):
+    def set_next_boot(self, image, reply_handler=None, error_handler=None):
         """
         Set the image to be used for the next boot.
 
         Args:
             image: The name of the image to set for the next boot.
         """
+        return self._dispatch(
+            self.installer_executor, self._set_next_boot, (image,), reply_handler, error_handler
+        )
+
+    def _set_next_boot(self, image):
+        """
+        Set the next boot image with sonic-installer, see set_next_boot().
+        """
         logger.info("Setting the next boot image to {}".format(image))
         cmd = ["/usr/local/bin/sonic-installer", "set-next-boot", image]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with self._changing_images():
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+            )
+            _, stderr = proc.communicate()
         msg = "Boot image set to {}".format(image)
         logger.info(msg)
-        if result.returncode:
-            logger.error("Failed to set next boot image: {}".format(result.stderr.decode()))
-            msg = result.stderr.decode()
+        if proc.returncode:
+            logger.error("Failed to set next boot image: {}".format(stderr))
+            msg = stderr
             # sonic-installer might not return a proper error code, so we need to check the message.
             if "not" in msg.lower() and ("exist" in msg.lower() or "found" in msg.lower()):
                 return errno.ENOENT, msg
-        return result.returncode, msg
+        return proc.returncode, msg
 
 
     def _parse_sonic_installer_list(self, output):
@@ -192,33 +852,42 @@ class ImageService(host_service.HostModule):
             output: The output of the sonic-installer list command.
 
         Returns:
-            A dictionary with keys "current", "next", and "available" containing the respective images.
+            A dictionary with the image names in "images", and keys "current", "next" (-1 if not
+            listed) and "available" holding indices into "images".
         """
-        current_image = ""
-        next_image = ""
+        images = []
+        index = {}
+
+        def image_index(name):
+            if name not in index:
+                index[name] = len(images)
+                images.append(name)
+            return index[name]
+
+        current_image = -1
+        next_image = -1
         available_images = []
 
-        for line in output.split("\n"):
-            if "current:" in line.lower():
-                parts = line.split(":")
-                if len(parts) > 1:
-                    current_image = parts[1].strip()
-            elif "next:" in line.lower():
-                parts = line.split(":")
-                if len(parts) > 1:
-                    next_image = parts[1].strip()
-            elif "available:" in line.lower():
+        for line in output.splitlines():
+            m = _LIST_LINE_RE.match(line)
+            if not m:
+                available_images.append(image_index(line.strip()))
                 continue
-            else:
-                available_images.append(line.strip())
-
-        logger.info("Current image: {}".format(current_image))
-        logger.info("Next image: {}".format(next_image))
-        logger.info("Available images: {}".format(available_images))
+            field, value = m.group(1).lower(), m.group(2).strip()
+            if field == "current" and value:
+                current_image = image_index(value)
+            elif field == "next" and value:
+                next_image = image_index(value)
+
+        logger.info("Current image: {}".format(images[current_image] if current_image >= 0 else ""))
+        logger.info("Next image: {}".format(images[next_image] if next_image >= 0 else ""))
+        logger.info("Available images: {}".format([images[i] for i in available_images]))
         return {
-            "current": current_image or "",
-            "next": next_image or "",
-            "available": available_images or [],
+            "version": 2,
+            "images": images,
+            "current": current_image,
+            "next": next_image,
+            "available": available_images,
         }
 
     @host_service.method(
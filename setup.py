@@ -78,6 +78,9 @@ setup(
             'pyfakefs',
             'sonic-py-common',
             'deepdiff>=6.2.2'
+        ],
+        "blake3": [
+            'blake3>=0.4.0'
         ]
     },
     classifiers = [
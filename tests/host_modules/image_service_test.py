@@ -1,24 +1,31 @@
+import gzip
 import hashlib
+import io
 import subprocess
 import sys
 import os
+import queue
 import stat
 import pytest
 import json
 import errno
+import requests
+import urllib3
 from unittest import mock
-from host_modules.image_service import ImageService
+from host_modules.image_service import ImageService, _SESSION
+
+_real_stat = os.stat
 
 
 class TestImageService(object):
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isdir")
     @mock.patch("os.stat")
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
     def test_download_success(
-        self, mock_get, mock_stat, mock_isdir, MockInit, MockBusName, MockSystemBus
+        self, mock_head, mock_get, mock_stat, MockInit, MockBusName, MockSystemBus
     ):
         """
         Test that the `download` method successfully downloads an image when the directory exists and is writable.
@@ -27,12 +34,11 @@ class TestImageService(object):
         image_service = ImageService(mod_name="image_service")
         image_url = "http://example.com/sonic_image.img"
         save_as = "/tmp/sonic_image.img"
-        mock_isdir.return_value = True
-        mock_stat.return_value.st_mode = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        mock_stat.return_value.st_mode = stat.S_IFDIR | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
         mock_response = mock.Mock()
-        mock_response.iter_content = lambda chunk_size: [b"data"]
+        mock_response.raw = io.BytesIO(b"data")
         mock_response.status_code = 200
-        mock_response.iter_content = lambda chunk_size: iter([b"data"])
+        mock_response.headers = {}
         mock_get.return_value = mock_response
 
         # Act
@@ -48,18 +54,468 @@ class TestImageService(object):
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isdir")
+    @mock.patch("os.setxattr")
+    @mock.patch("os.getxattr")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_verified_success(
+        self, mock_head, mock_get, mock_getxattr, mock_setxattr, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download_verified` method saves the image when its sha256 matches, and caches the
+        checksum so that `checksum` does not read the image again.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw = io.BytesIO(b"data")
+        mock_get.return_value = mock_response
+        expected_checksum = hashlib.sha256(b"data").hexdigest()
+        # Writing trusted.* xattrs needs CAP_SYS_ADMIN, which the tests may not have.
+        xattrs = {}
+        mock_setxattr.side_effect = lambda path, name, value: xattrs.__setitem__(name, value)
+        mock_getxattr.side_effect = lambda path, name: xattrs[name]
+
+        # Act
+        rc, msg = image_service.download_verified(image_url, save_as, expected_checksum.upper())
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == b"data", "downloaded image content does not match"
+        with mock.patch("builtins.open") as mock_open:
+            rc, checksum = image_service.checksum(save_as, "sha256")
+        assert rc == 0, "wrong return value"
+        assert checksum == expected_checksum, "checksum does not match expected value"
+        mock_open.assert_not_called()
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_verified_checksum_mismatch(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download_verified` method discards the image when its sha256 does not match.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw = io.BytesIO(b"corrupted")
+        mock_get.return_value = mock_response
+
+        # Act
+        rc, msg = image_service.download_verified(image_url, save_as, hashlib.sha256(b"data").hexdigest())
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert "checksum mismatch" in msg.lower(), "message should contain 'checksum mismatch'"
+        assert not os.path.exists(save_as), "image with wrong checksum should not be saved"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_interrupted_removes_temp_file(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download` method removes its temporary file from the destination directory when the
+        download is interrupted.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+
+        reads = []
+
+        def interrupted_readinto(buf):
+            if not reads:
+                reads.append(buf)
+                buf[:4] = b"data"
+                return 4
+            assert any(name.startswith(".sonic-dl-") for name in os.listdir(str(tmp_path))), \
+                "temporary file should be created in the destination directory"
+            raise IOError("Connection reset")
+
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.raw.readinto.side_effect = interrupted_readinto
+        mock_get.return_value = mock_response
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert "connection reset" in msg.lower(), "message should contain 'connection reset'"
+        assert os.listdir(str(tmp_path)) == [], "temporary file should be removed"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_download_buffer_pool(self, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that download buffers are reused, and that the pool keeps a bounded number of idle buffers.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        pool = queue.LifoQueue(maxsize=1)
+
+        with mock.patch("host_modules.image_service._BUFFER_POOL", pool):
+            # Act
+            with image_service._pooled_buffer() as buf1, image_service._pooled_buffer() as buf2:
+                assert buf1.obj is not buf2.obj, "buffers in use should not be shared"
+                assert len(buf1) == len(buf2) == 1024 * 1024, "buffers should hold one download chunk"
+            with image_service._pooled_buffer() as buf3:
+                pass
+
+        # Assert
+        assert buf3.obj is buf2.obj, "buffer should be reused"
+        assert pool.qsize() == 1, "pool should not grow past its maximum size"
+
+    @staticmethod
+    def _mock_ranged_get(data, status_code=206):
+        """
+        Build a requests.get side effect serving byte ranges of `data`.
+        """
+        def ranged_get(url, headers=None, stream=False):
+            start, end = headers["Range"][len("bytes="):].split("-")
+            response = mock.Mock()
+            response.status_code = status_code
+            response.headers = {"Content-Range": "bytes {}-{}/{}".format(start, end, len(data))}
+            part = data[int(start):int(end) + 1]
+            response.raw = io.BytesIO(part)
+            return response
+        return ranged_get
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_parallel_ranges(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download` method fetches large images with parallel range requests when the server
+        supports them.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        data = os.urandom(1000)
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {
+            "Accept-Ranges": "bytes", "Content-Length": str(len(data)), "ETag": '"v1"'
+        }
+        mock_get.side_effect = self._mock_ranged_get(data)
+
+        # Act
+        with mock.patch("host_modules.image_service.PARALLEL_DOWNLOAD_MIN_SIZE", 100), \
+                mock.patch("os.posix_fadvise", wraps=os.posix_fadvise) as mock_fadvise:
+            rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == data, "downloaded image content does not match"
+        assert all(call[0][3] != os.POSIX_FADV_DONTNEED for call in mock_fadvise.call_args_list), \
+            "downloaded image should stay in the page cache"
+        assert mock_get.call_count == 4, "image should be fetched with one request per worker"
+        mock_get.assert_any_call(image_url, headers={"Range": "bytes=0-249", "If-Range": '"v1"'}, stream=True)
+        mock_get.assert_any_call(image_url, headers={"Range": "bytes=750-999", "If-Range": '"v1"'}, stream=True)
+        rc, checksum = image_service.checksum(save_as, "sha256")
+        assert checksum == hashlib.sha256(data).hexdigest(), "checksum does not match expected value"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_parallel_ranges_ignored(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download` method falls back to a single stream when the server ignores range requests.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        data = os.urandom(1000)
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {
+            "Accept-Ranges": "bytes", "Content-Length": str(len(data)), "ETag": '"v1"'
+        }
+        ranged_get = self._mock_ranged_get(data, status_code=200)
+        full_response = mock.Mock()
+        full_response.status_code = 200
+        full_response.headers = {}
+        full_response.raw = io.BytesIO(data)
+        mock_get.side_effect = lambda url, headers=None, stream=False: (
+            ranged_get(url, headers, stream) if headers else full_response
+        )
+
+        # Act
+        with mock.patch("host_modules.image_service.PARALLEL_DOWNLOAD_MIN_SIZE", 100):
+            rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == data, "downloaded image content does not match"
+        mock_get.assert_called_with(image_url, stream=True)
+
+    @pytest.mark.parametrize(
+        "validator_headers, expected_if_range",
+        [
+            ({"ETag": '"v1"', "Last-Modified": "Wed, 14 Oct 2026 10:00:00 GMT"}, '"v1"'),
+            ({"ETag": 'W/"v1"', "Last-Modified": "Wed, 14 Oct 2026 10:00:00 GMT"}, "Wed, 14 Oct 2026 10:00:00 GMT"),
+            ({"ETag": 'W/"v1"'}, None),
+            ({}, None),
+        ],
+    )
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.head")
+    def test_get_ranged_download_validator(
+        self, mock_head, MockInit, MockBusName, MockSystemBus, validator_headers, expected_if_range
+    ):
+        """
+        Test that parallel range requests are only used when the image has a strong ETag or a Last-Modified date
+        to send as If-Range.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = dict(validator_headers, **{"Accept-Ranges": "bytes", "Content-Length": "1000"})
+
+        # Act
+        size, validator = image_service._get_ranged_download("http://example.com/sonic_image.img")
+
+        # Assert
+        assert validator == expected_if_range, "wrong If-Range validator"
+        assert size == (1000 if expected_if_range else 0), "wrong image size"
+
+    @pytest.mark.parametrize("honors_if_range", [True, False])
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_parallel_ranges_image_changed(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, honors_if_range, tmp_path
+    ):
+        """
+        Test that the `download` method does not mix parts of two versions of an image that changes while it is
+        downloaded, whether the server answers If-Range with the whole new image or ignores it.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        old_data = os.urandom(1000)
+        new_data = os.urandom(1200)
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {
+            "Accept-Ranges": "bytes", "Content-Length": str(len(old_data)), "ETag": '"v1"'
+        }
+        old_get = self._mock_ranged_get(old_data)
+        new_get = self._mock_ranged_get(new_data)
+        full_response = mock.Mock()
+        full_response.status_code = 200
+        full_response.headers = {}
+        full_response.raw = io.BytesIO(new_data)
+
+        def get(url, headers=None, stream=False):
+            # The image is replaced after the first range was served.
+            if headers and headers["Range"] == "bytes=0-249":
+                return old_get(url, headers, stream)
+            if headers and not honors_if_range:
+                return new_get(url, headers, stream)
+            return full_response
+        mock_get.side_effect = get
+
+        # Act
+        with mock.patch("host_modules.image_service.PARALLEL_DOWNLOAD_MIN_SIZE", 100):
+            rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == new_data, "downloaded image should be the new image as a whole"
+        mock_get.assert_called_with(image_url, stream=True)
+
+    @pytest.mark.parametrize("status_code", [403, 416])
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_parallel_ranges_rejected(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, status_code, tmp_path
+    ):
+        """
+        Test that the `download` method falls back to a single stream when the server advertises range support
+        but rejects range requests.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        data = os.urandom(1000)
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {
+            "Accept-Ranges": "bytes", "Content-Length": str(len(data)), "ETag": '"v1"'
+        }
+        ranged_get = self._mock_ranged_get(b"", status_code=status_code)
+        full_response = mock.Mock()
+        full_response.status_code = 200
+        full_response.headers = {}
+        full_response.raw = io.BytesIO(data)
+        mock_get.side_effect = lambda url, headers=None, stream=False: (
+            ranged_get(url, headers, stream) if headers else full_response
+        )
+
+        # Act
+        with mock.patch("host_modules.image_service.PARALLEL_DOWNLOAD_MIN_SIZE", 100):
+            rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == data, "downloaded image content does not match"
+        mock_get.assert_called_with(image_url, stream=True)
+        assert os.listdir(tmp_path) == ["sonic_image.img"], "temporary file should be removed"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_gzip_encoded(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download` method asks for an unencoded body, and still saves the decoded image when the
+        server gzip-encodes it anyway.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        # Compresses well, so that decoded chunks are larger than the read buffer.
+        data = b"sonic" * (1024 * 1024)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Encoding"] = "gzip"
+        response.raw = urllib3.HTTPResponse(
+            body=io.BytesIO(gzip.compress(data)), headers={"Content-Encoding": "gzip"},
+            status=200, preload_content=False,
+        )
+        mock_get.return_value = response
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == data, "downloaded image should be decoded"
+        assert _SESSION.headers["Accept-Encoding"] == "identity", "an unencoded body should be requested"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_parallel_ranges_gzip_encoded(
+        self, mock_head, mock_get, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `download` method falls back to a single stream when the server encodes the ranges.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        tmp_path.chmod(0o777)
+        save_as = str(tmp_path / "sonic_image.img")
+        data = os.urandom(1000)
+        mock_head.return_value.status_code = 200
+        mock_head.return_value.headers = {
+            "Accept-Ranges": "bytes", "Content-Length": str(len(data)), "ETag": '"v1"'
+        }
+        ranged_get = self._mock_ranged_get(data)
+        full_response = mock.Mock()
+        full_response.status_code = 200
+        full_response.headers = {}
+        full_response.raw = io.BytesIO(data)
+
+        def get(url, headers=None, stream=False):
+            if not headers:
+                return full_response
+            response = ranged_get(url, headers, stream)
+            response.headers["Content-Encoding"] = "gzip"
+            return response
+        mock_get.side_effect = get
+
+        # Act
+        with mock.patch("host_modules.image_service.PARALLEL_DOWNLOAD_MIN_SIZE", 100):
+            rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        with open(save_as, "rb") as f:
+            assert f.read() == data, "downloaded image content does not match"
+        mock_get.assert_called_with(image_url, stream=True)
+
+    @pytest.mark.parametrize(
+        "stat_error",
+        [
+            FileNotFoundError(errno.ENOENT, "No such file or directory"),
+            PermissionError(errno.EACCES, "Permission denied"),
+            OSError(errno.ELOOP, "Too many levels of symbolic links"),
+        ],
+    )
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
     def test_download_fail_no_dir(
-        self, mock_isdir, MockInit, MockBusName, MockSystemBus
+        self, mock_stat, MockInit, MockBusName, MockSystemBus, stat_error
     ):
         """
-        Test that the `download` method fails when the directory does not exist.
+        Test that the `download` method fails when the directory does not exist or can't be looked up.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
         image_url = "http://example.com/sonic_image.img"
         save_as = "/nonexistent_dir/sonic_image.img"
-        mock_isdir.return_value = False
+        mock_stat.side_effect = stat_error
 
         # Act
         rc, msg = image_service.download(image_url, save_as)
@@ -73,10 +529,33 @@ class TestImageService(object):
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isdir")
+    def test_download_fail_not_a_dir(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `download` method fails when the parent of the save_as path is not a directory.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        not_a_dir = tmp_path / "file"
+        not_a_dir.write_bytes(b"")
+        not_a_dir.chmod(0o666)
+        save_as = str(not_a_dir / "sonic_image.img")
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc == errno.ENOENT, "wrong return value"
+        assert (
+            "not" in msg.lower() and "exist" in msg.lower()
+        ), "message should contains 'not' and 'exist'"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
     @mock.patch("os.stat")
     def test_download_fail_missing_other_write(
-        self, mock_stat, mock_isdir, MockInit, MockBusName, MockSystemBus
+        self, mock_stat, MockInit, MockBusName, MockSystemBus
     ):
         """
         Test that the `download` method fails when the directory is not writable by others.
@@ -85,9 +564,8 @@ class TestImageService(object):
         image_service = ImageService(mod_name="image_service")
         image_url = "http://example.com/sonic_image.img"
         save_as = "/tmp/sonic_image.img"
-        mock_isdir.return_value = True
         mock_stat.return_value.st_mode = (
-            stat.S_IWUSR | stat.S_IWGRP
+            stat.S_IFDIR | stat.S_IWUSR | stat.S_IWGRP
         )  # Missing write permission for others
 
         # Act
@@ -108,188 +586,501 @@ class TestImageService(object):
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        image_url = "http://example.com/sonic_image.img"
-        save_as = "relative/path/sonic_image.img"
+        image_url = "http://example.com/sonic_image.img"
+        save_as = "relative/path/sonic_image.img"
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert "absolute" in msg.lower(), "message should contain 'absolute'"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    def test_download_failed_not_found(
+        self, mock_head, mock_get, mock_stat, MockInit, MockBusName, MockSystemBus
+    ):
+        """
+        Test that the `download` method fails when the image URL is not found (404 error).
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/nonexistent_image.img"
+        save_as = "/tmp/sonic_image.img"
+        mock_stat.return_value.st_mode = stat.S_IFDIR | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        mock_response = mock.Mock()
+        mock_response.status_code = 404
+        mock_get.return_value = mock_response
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert (
+            "404" in msg and "error" in msg.lower()
+        ), "message should contain '404' and 'error'"
+        mock_get.assert_called_once_with(image_url, stream=True)
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
+    @mock.patch("requests.Session.get")
+    @mock.patch("requests.Session.head")
+    @mock.patch("tempfile.mkstemp")
+    def test_download_fail_write_io_exception(
+        self,
+        mock_tempfile,
+        mock_head,
+        mock_get,
+        mock_stat,
+        MockInit,
+        MockBusName,
+        MockSystemBus,
+    ):
+        """
+        Test that the `download` method fails when there is an IOError while writing the file.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        image_url = "http://example.com/sonic_image.img"
+        save_as = "/tmp/sonic_image.img"
+        mock_stat.return_value.st_mode = stat.S_IFDIR | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        mock_response = mock.Mock()
+        mock_response.raw = io.BytesIO(b"data")
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_get.return_value = mock_response
+        mock_tempfile.side_effect = IOError("Disk write error")
+
+        # Act
+        rc, msg = image_service.download(image_url, save_as)
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert (
+            "disk write error" in msg.lower()
+        ), "message should contain 'disk write error'"
+        mock_get.assert_called_once_with(image_url, stream=True)
+        mock_tempfile.assert_called_once_with(
+            dir=os.path.dirname(save_as), prefix=".sonic-dl-"
+        )
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.Popen")
+    def test_install_success(self, mock_popen, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the `install` method successfully installs an image.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        where = "/tmp/sonic_image.img"
+        mock_proc = mock.Mock()
+        mock_proc.stderr = io.StringIO("Installing image\n")
+        mock_proc.wait.return_value = 0
+        mock_popen.return_value = mock_proc
+
+        # Act
+        rc, msg = image_service.install(where)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert msg == "", "message should be empty on success"
+        mock_popen.assert_called_once_with(
+            ["/usr/local/bin/sonic-installer", "install", "-y", where],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.Popen")
+    def test_install_fail(self, mock_popen, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the `install` method fails when the installation command returns a non-zero exit code.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        where = "/tmp/sonic_image.img"
+        mock_proc = mock.Mock()
+        mock_proc.stderr = io.StringIO(
+            "Installing image\nError: Installation failed\nError: Cleanup failed\n"
+        )
+        mock_proc.wait.return_value = 1
+        mock_popen.return_value = mock_proc
+
+        # Act
+        rc, msg = image_service.install(where)
+
+        # Assert
+        assert rc != 0, "wrong return value"
+        assert msg == "Error: Installation failed", "message should be the first error line"
+        mock_popen.assert_called_once_with(
+            ["/usr/local/bin/sonic-installer", "install", "-y", where],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    @pytest.mark.parametrize(
+        "algorithm, expected_checksum",
+        [
+            ("sha256", hashlib.sha256(b"test data").hexdigest()),
+            ("sha512", hashlib.sha512(b"test data").hexdigest()),
+            ("md5", hashlib.md5(b"test data").hexdigest()),
+        ],
+    )
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum(
+        self,
+        MockInit,
+        MockBusName,
+        MockSystemBus,
+        algorithm,
+        expected_checksum,
+        tmp_path,
+    ):
+        """
+        Test that the `checksum` method correctly calculates the checksum of a file for different algorithms.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+
+        # Act
+        rc, checksum = image_service.checksum(str(file_path), algorithm)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == expected_checksum, "checksum does not match expected value"
+
+    @pytest.mark.parametrize("algorithm", ["sha256", "sha256-tree"])
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum_fadvise(self, MockInit, MockBusName, MockSystemBus, algorithm, tmp_path):
+        """
+        Test that the `checksum` method drops the pages of the hashed file from the page cache.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+
+        # Act
+        with mock.patch("os.posix_fadvise", wraps=os.posix_fadvise) as mock_fadvise:
+            rc, checksum = image_service.checksum(str(file_path), algorithm)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert mock_fadvise.call_args[0][1:] == (0, 0, os.POSIX_FADV_DONTNEED), "pages should be dropped"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum_multiple_chunks(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `checksum` method hashes files larger than a single read buffer
+        when hashlib.file_digest is unavailable (Python < 3.11).
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        data = os.urandom(1024) * 5
+        file_path.write_bytes(data)
+
+        # Act
+        with mock.patch("host_modules.image_service.CHECKSUM_CHUNK_SIZE", 1000), \
+                mock.patch.object(sys, "version_info", (3, 10, 0)):
+            rc, checksum = image_service.checksum(str(file_path), "sha256")
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == hashlib.sha256(data).hexdigest(), "checksum does not match expected value"
+
+    @pytest.mark.parametrize(
+        "algorithm, hash_ctor, data",
+        [
+            ("sha256-tree", hashlib.sha256, b"0123456789" * 25),
+            ("sha512-tree", hashlib.sha512, b"0123456789" * 25),
+            ("sha256-tree", hashlib.sha256, b"0123456789" * 10),
+            ("sha256-tree", hashlib.sha256, b""),
+        ],
+    )
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum_tree(
+        self, MockInit, MockBusName, MockSystemBus, algorithm, hash_ctor, data, tmp_path
+    ):
+        """
+        Test that the `checksum` method computes tree digests as the hash of the concatenated leaf digests.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(data)
+        leaf_size = 100
+        leaves = [data[i:i + leaf_size] for i in range(0, len(data), leaf_size)]
+        expected_checksum = hash_ctor(b"".join(hash_ctor(leaf).digest() for leaf in leaves)).hexdigest()
+
+        # Act
+        with mock.patch("host_modules.image_service.TREE_HASH_LEAF_SIZE", leaf_size):
+            rc, checksum = image_service.checksum(str(file_path), algorithm)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == expected_checksum, "checksum does not match expected value"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum_blake3(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `checksum` method computes blake3 digests when the blake3 package is installed.
+        """
+        blake3 = pytest.importorskip("blake3")
+
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+
+        # Act
+        rc, checksum = image_service.checksum(str(file_path), "blake3")
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == blake3.blake3(b"test data").hexdigest(), "checksum does not match expected value"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_checksum_blake3_without_update_mmap(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `checksum` method still computes blake3 digests with blake3 releases that lack update_mmap().
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        # hashlib hashes have no update_mmap() either.
+        old_blake3 = mock.Mock(blake3=hashlib.sha256)
+
+        # Act
+        with mock.patch("host_modules.image_service.blake3", old_blake3):
+            rc, checksum = image_service.checksum(str(file_path), "blake3")
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == hashlib.sha256(b"test data").hexdigest(), "checksum does not match expected value"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("host_modules.image_service.blake3", None)
+    def test_checksum_blake3_not_installed(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `checksum` method rejects blake3 when the blake3 package is not installed.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+
+        # Act
+        rc, msg = image_service.checksum(str(file_path), "blake3")
+
+        # Assert
+        assert rc == errno.EINVAL, "wrong return value"
+        assert "unsupported algorithm" in msg.lower(), "message should contain 'unsupported algorithm'"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.setxattr")
+    @mock.patch("os.getxattr")
+    def test_checksum_cache_hit(
+        self, mock_getxattr, mock_setxattr, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that the `checksum` method returns the digest cached in the file's xattrs without reading the file.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        file_path.chmod(0o644)
+        st = os.stat(file_path)
+        mock_getxattr.return_value = "{}:{}:cached_digest".format(st.st_size, st.st_mtime_ns).encode()
 
         # Act
-        rc, msg = image_service.download(image_url, save_as)
+        with mock.patch("builtins.open") as mock_open:
+            rc, checksum = image_service.checksum(str(file_path), "sha256")
 
         # Assert
-        assert rc != 0, "wrong return value"
-        assert "absolute" in msg.lower(), "message should contain 'absolute'"
+        assert rc == 0, "wrong return value"
+        assert checksum == "cached_digest", "cached checksum should be returned"
+        mock_getxattr.assert_called_once_with(str(file_path), "trusted.image_service.sha256")
+        mock_open.assert_not_called()
+        mock_setxattr.assert_not_called()
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isdir")
-    @mock.patch("os.stat")
-    @mock.patch("requests.get")
-    def test_download_failed_not_found(
-        self, mock_get, mock_stat, mock_isdir, MockInit, MockBusName, MockSystemBus
+    @mock.patch("os.setxattr")
+    @mock.patch("os.getxattr")
+    def test_checksum_cache_stale(
+        self, mock_getxattr, mock_setxattr, MockInit, MockBusName, MockSystemBus, tmp_path
     ):
         """
-        Test that the `download` method fails when the image URL is not found (404 error).
+        Test that the `checksum` method ignores a cached digest when the file has been modified since, and
+        refreshes the cache.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        image_url = "http://example.com/nonexistent_image.img"
-        save_as = "/tmp/sonic_image.img"
-        mock_isdir.return_value = True
-        mock_stat.return_value.st_mode = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
-        mock_response = mock.Mock()
-        mock_response.status_code = 404
-        mock_get.return_value = mock_response
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        file_path.chmod(0o644)
+        st = os.stat(file_path)
+        mock_getxattr.return_value = "{}:0:cached_digest".format(st.st_size).encode()
+        expected_checksum = hashlib.sha256(b"test data").hexdigest()
 
         # Act
-        rc, msg = image_service.download(image_url, save_as)
+        rc, checksum = image_service.checksum(str(file_path), "sha256")
 
         # Assert
-        assert rc != 0, "wrong return value"
-        assert (
-            "404" in msg and "error" in msg.lower()
-        ), "message should contain '404' and 'error'"
-        mock_get.assert_called_once_with(image_url, stream=True)
+        assert rc == 0, "wrong return value"
+        assert checksum == expected_checksum, "checksum does not match expected value"
+        mock_setxattr.assert_called_once_with(
+            str(file_path),
+            "trusted.image_service.sha256",
+            "{}:{}:{}".format(st.st_size, st.st_mtime_ns, expected_checksum).encode(),
+        )
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isdir")
-    @mock.patch("os.stat")
-    @mock.patch("requests.get")
-    @mock.patch("tempfile.NamedTemporaryFile")
-    def test_download_fail_write_io_exception(
-        self,
-        mock_tempfile,
-        mock_get,
-        mock_stat,
-        mock_isdir,
-        MockInit,
-        MockBusName,
-        MockSystemBus,
+    @mock.patch("os.setxattr")
+    @mock.patch("os.getxattr")
+    def test_checksum_not_cached_for_writable_file(
+        self, mock_getxattr, mock_setxattr, MockInit, MockBusName, MockSystemBus, tmp_path
     ):
         """
-        Test that the `download` method fails when there is an IOError while writing the file.
+        Test that the `checksum` method does not cache the digest of a file others can write, so that changing
+        its content and restoring its mtime can't make it return the digest of the original content.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        image_url = "http://example.com/sonic_image.img"
-        save_as = "/tmp/sonic_image.img"
-        mock_isdir.return_value = True
-        mock_stat.return_value.st_mode = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
-        mock_response = mock.Mock()
-        mock_response.iter_content = lambda chunk_size: [b"data"]
-        mock_response.status_code = 200
-        mock_get.return_value = mock_response
-        mock_tempfile.side_effect = IOError("Disk write error")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        file_path.chmod(0o666)
+        xattrs = {}
+        mock_setxattr.side_effect = lambda path, name, value: xattrs.__setitem__(name, value)
+        mock_getxattr.side_effect = lambda path, name: xattrs[name]
+        rc, original_checksum = image_service.checksum(str(file_path), "sha256")
+        st = os.stat(file_path)
 
         # Act
-        rc, msg = image_service.download(image_url, save_as)
+        file_path.write_bytes(b"evil data")
+        os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        rc, checksum = image_service.checksum(str(file_path), "sha256")
 
         # Assert
-        assert rc != 0, "wrong return value"
-        assert (
-            "disk write error" in msg.lower()
-        ), "message should contain 'disk write error'"
-        mock_get.assert_called_once_with(image_url, stream=True)
-        mock_tempfile.assert_called_once_with(
-            delete=False, dir=os.path.dirname(save_as)
-        )
+        assert rc == 0, "wrong return value"
+        assert original_checksum == hashlib.sha256(b"test data").hexdigest()
+        assert checksum == hashlib.sha256(b"evil data").hexdigest(), "checksum should be computed again"
+        mock_setxattr.assert_not_called()
+        mock_getxattr.assert_not_called()
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("subprocess.run")
-    def test_install_success(self, mock_run, MockInit, MockBusName, MockSystemBus):
+    @mock.patch("os.setxattr")
+    @mock.patch("os.getxattr")
+    def test_checksum_xattr_not_supported(
+        self, mock_getxattr, mock_setxattr, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
         """
-        Test that the `install` method successfully installs an image.
+        Test that the `checksum` method still succeeds when the filesystem does not support xattrs.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        where = "/tmp/sonic_image.img"
-        mock_result = mock.Mock()
-        mock_result.returncode = 0
-        mock_result.stderr = b""
-        mock_run.return_value = mock_result
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        file_path.chmod(0o644)
+        mock_getxattr.side_effect = OSError(errno.ENOTSUP, "Operation not supported")
+        mock_setxattr.side_effect = OSError(errno.ENOTSUP, "Operation not supported")
 
         # Act
-        rc, msg = image_service.install(where)
+        rc, checksum = image_service.checksum(str(file_path), "sha256")
 
         # Assert
         assert rc == 0, "wrong return value"
-        assert msg == "", "message should be empty on success"
-        mock_run.assert_called_once_with(
-            ["/usr/local/bin/sonic-installer", "install", "-y", where],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        assert checksum == hashlib.sha256(b"test data").hexdigest(), "checksum does not match expected value"
+        mock_setxattr.assert_called_once()
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("subprocess.run")
-    def test_install_fail(self, mock_run, MockInit, MockBusName, MockSystemBus):
+    def test_checksum_async_reply(self, MockInit, MockBusName, MockSystemBus, tmp_path):
         """
-        Test that the `install` method fails when the installation command returns a non-zero exit code.
+        Test that the `checksum` method runs on the worker pool and sends its result through the DBus
+        reply handler when called over DBus.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        where = "/tmp/sonic_image.img"
-        mock_result = mock.Mock()
-        mock_result.returncode = 1
-        mock_result.stderr = b"Error: Installation failed"
-        mock_run.return_value = mock_result
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        reply_handler = mock.Mock()
+        error_handler = mock.Mock()
 
         # Act
-        rc, msg = image_service.install(where)
+        result = image_service.checksum(
+            str(file_path), "sha256", reply_handler=reply_handler, error_handler=error_handler
+        )
+        image_service.transfer_executor.shutdown(wait=True)
 
         # Assert
-        assert rc != 0, "wrong return value"
-        assert "Error" in msg, "message should contain 'Error'"
-        mock_run.assert_called_once_with(
-            ["/usr/local/bin/sonic-installer", "install", "-y", where],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        assert result is None, "DBus calls should not return the result directly"
+        reply_handler.assert_called_once_with(0, hashlib.sha256(b"test data").hexdigest())
+        error_handler.assert_not_called()
 
-    @pytest.mark.parametrize(
-        "algorithm, expected_checksum",
-        [
-            ("sha256", hashlib.sha256(b"test data").hexdigest()),
-            ("sha512", hashlib.sha512(b"test data").hexdigest()),
-            ("md5", hashlib.md5(b"test data").hexdigest()),
-        ],
-    )
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isfile")
-    @mock.patch("builtins.open", new_callable=mock.mock_open, read_data=b"test data")
-    def test_checksum(
-        self,
-        mock_open,
-        mock_isfile,
-        MockInit,
-        MockBusName,
-        MockSystemBus,
-        algorithm,
-        expected_checksum,
-    ):
+    @mock.patch("subprocess.Popen")
+    def test_install_async_error(self, mock_popen, MockInit, MockBusName, MockSystemBus):
         """
-        Test that the `checksum` method correctly calculates the checksum of a file for different algorithms.
+        Test that the `install` method reports exceptions through the DBus error handler when called over DBus.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        file_path = "/tmp/test_file.img"
-        mock_isfile.return_value = True
+        error = FileNotFoundError(errno.ENOENT, "No such file or directory")
+        mock_popen.side_effect = error
+        reply_handler = mock.Mock()
+        error_handler = mock.Mock()
 
         # Act
-        rc, checksum = image_service.checksum(file_path, algorithm)
+        image_service.install("/tmp/sonic_image.img", reply_handler=reply_handler, error_handler=error_handler)
+        image_service.installer_executor.shutdown(wait=True)
 
         # Assert
-        assert rc == 0, "wrong return value"
-        assert checksum == expected_checksum, "checksum does not match expected value"
-        mock_isfile.assert_called_once_with(file_path)
-        mock_open.assert_called_once_with(file_path, "rb")
+        reply_handler.assert_not_called()
+        error_handler.assert_called_once_with(error)
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
@@ -344,19 +1135,18 @@ class TestImageService(object):
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("os.path.isfile")
-    @mock.patch("builtins.open", new_callable=mock.mock_open, read_data=b"test data")
     def test_checksum_general_exception(
-        self, mock_open, mock_isfile, MockInit, MockBusName, MockSystemBus
+        self, MockInit, MockBusName, MockSystemBus, tmp_path
     ):
         """
         Test that the `checksum` method handles general exceptions during file reading.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
-        file_path = "/tmp/test_file.img"
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        file_path = str(file_path)
         algorithm = "sha256"
-        mock_isfile.return_value = True
 
         with mock.patch.object(hashlib, algorithm) as mock_hash_func:
             mock_hash_instance = mock_hash_func.return_value
@@ -370,8 +1160,52 @@ class TestImageService(object):
             assert (
                 "general error" in msg.lower()
             ), "message should contain 'general error'"
-            mock_isfile.assert_called_once_with(file_path)
-            mock_open.assert_called_once_with(file_path, "rb")
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_quick_checksum(self, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `quick_checksum` method fingerprints a file from its path, size and mtime, and that the
+        fingerprint changes when the file is modified.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        file_path = tmp_path / "test_file.img"
+        file_path.write_bytes(b"test data")
+        st = os.stat(file_path)
+        expected = hashlib.sha256(
+            "{}:{}:{}".format(st.st_size, st.st_mtime_ns, file_path).encode()
+        ).hexdigest()
+
+        # Act
+        with mock.patch("builtins.open") as mock_open:
+            rc, checksum = image_service.quick_checksum(str(file_path))
+        os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        _, modified_checksum = image_service.quick_checksum(str(file_path))
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert checksum == expected, "checksum does not match expected value"
+        assert modified_checksum != checksum, "checksum should change when the mtime changes"
+        mock_open.assert_not_called()
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    def test_quick_checksum_no_such_file(self, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the `quick_checksum` method fails when the file does not exist.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+
+        # Act
+        rc, msg = image_service.quick_checksum("/nonexistent_dir/test_file.img")
+
+        # Assert
+        assert rc == errno.ENOENT, "wrong return value"
+        assert "not exist" in msg.lower(), "message should contain 'not exist'"
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
@@ -515,6 +1349,36 @@ class TestImageService(object):
             stderr=subprocess.STDOUT,
         )
 
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_success_irregular_spacing(self, mock_check_output, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the `list_images` method accepts extra whitespace around the field names and keeps colons
+        that are part of the image names.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_output = (
+            "  Current : image:1\n"
+            "NEXT:image:2  \n"
+            "Available :\n"
+            "image:1\n"
+            "image:2\n"
+        )
+        mock_check_output.return_value = mock_output.encode()
+
+        # Act
+        rc, images_json = image_service.list_images()
+        images = json.loads(images_json)
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert images["current"] == "image:1", "current image does not match"
+        assert images["next"] == "image:2", "next image does not match"
+        assert images["available"] == ["image:1", "image:2"], "available images do not match"
+
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
@@ -545,6 +1409,244 @@ class TestImageService(object):
         )
 
 
+    @pytest.mark.parametrize(
+        "mock_output, expected",
+        [
+            (
+                "Current: image1\nNext: image1\nAvailable:\nimage1\nimage2\n",
+                {"version": 2, "images": ["image1", "image2"], "current": 0, "next": 0, "available": [0, 1]},
+            ),
+            (
+                "Current: image1\nNext: image2\nAvailable:\nimage2\nimage1\n",
+                {"version": 2, "images": ["image1", "image2"], "current": 0, "next": 1, "available": [1, 0]},
+            ),
+            (
+                "Current: \nAvailable:\nimage1\n",
+                {"version": 2, "images": ["image1"], "current": -1, "next": -1, "available": [0]},
+            ),
+        ],
+    )
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_v2(self, mock_check_output, MockInit, MockBusName, MockSystemBus, mock_output, expected):
+        """
+        Test that the `list_images_v2` method lists every image name once and refers to them by index.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_check_output.return_value = mock_output.encode()
+
+        # Act
+        rc, images_json = image_service.list_images_v2()
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert json.loads(images_json) == expected, "image list does not match"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.check_output")
+    @mock.patch("host_modules.image_service.logger")
+    def test_list_images_logs_names(self, mock_logger, mock_check_output, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the parsed `list_images` result is logged with image names rather than indices.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_check_output.return_value = b"Current: image1\nNext: image2\nAvailable:\nimage1\nimage2\n"
+
+        # Act
+        image_service.list_images()
+
+        # Assert
+        mock_logger.info.assert_any_call("Current image: image1")
+        mock_logger.info.assert_any_call("Next image: image2")
+        mock_logger.info.assert_any_call("Available images: ['image1', 'image2']")
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_cached_both_versions(self, mock_check_output, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that a cached `list_images` result also serves `list_images_v2`, and the other way around.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_check_output.return_value = b"Current: image1\nNext: image2\nAvailable:\nimage1\nimage2\n"
+
+        with mock.patch.object(ImageService, "_list_images_cache_key", return_value="key"):
+            # Act
+            _, v1_json = image_service.list_images()
+            _, v2_json = image_service.list_images_v2()
+
+        # Assert
+        assert mock_check_output.call_count == 1, "sonic-installer should not run on a cache hit"
+        assert json.loads(v1_json) == {"current": "image1", "next": "image2", "available": ["image1", "image2"]}
+        assert json.loads(v2_json)["images"] == ["image1", "image2"]
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.Popen")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_cached(self, mock_check_output, mock_popen, MockInit, MockBusName, MockSystemBus):
+        """
+        Test that the `list_images` method only runs sonic-installer again when the cache key changes or
+        after the next boot image is set.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_check_output.return_value = b"Current: current_image\nNext: next_image\nAvailable:\nimage1\n"
+        mock_popen.return_value.returncode = 0
+        mock_popen.return_value.communicate.return_value = (None, "")
+
+        with mock.patch.object(ImageService, "_list_images_cache_key", return_value="key1") as mock_key:
+            # Act
+            first = image_service.list_images()
+            second = image_service.list_images()
+
+            # Assert
+            assert first == second, "cached result should match the original result"
+            assert mock_check_output.call_count == 1, "sonic-installer should not run on a cache hit"
+
+            mock_key.return_value = "key2"
+            image_service.list_images()
+            assert mock_check_output.call_count == 2, "sonic-installer should run when the key changes"
+
+            image_service.set_next_boot("image1")
+            image_service.list_images()
+            assert mock_check_output.call_count == 3, "set_next_boot should invalidate the cache"
+
+    @staticmethod
+    def _mock_installer_stat():
+        """
+        Build an os.stat side effect that makes sonic-installer exist and stats every other path for real.
+        """
+        def stat_side_effect(path, *args, **kwargs):
+            if path == "/usr/local/bin/sonic-installer":
+                return mock.Mock(st_mtime_ns=1)
+            return _real_stat(path, *args, **kwargs)
+        return stat_side_effect
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
+    def test_list_images_cache_key(self, mock_stat, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that the `list_images` cache key changes when an image is added under /host.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_stat.side_effect = self._mock_installer_stat()
+        (tmp_path / "grub").mkdir()
+        (tmp_path / "grub" / "grub.cfg").write_text("menuentry image-1 {}\n")
+        (tmp_path / "image-1").mkdir()
+
+        with mock.patch("host_modules.image_service.HOST_PATH", str(tmp_path)):
+            # Act
+            key1 = image_service._list_images_cache_key()
+            (tmp_path / "image-2").mkdir()
+            key2 = image_service._list_images_cache_key()
+
+        # Assert
+        assert key1 is not None, "cache key should be computed"
+        assert key1 != key2, "cache key should change when an image is added"
+        mock_stat.assert_any_call("/usr/local/bin/sonic-installer")
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_grubenv_rewritten(
+        self, mock_check_output, mock_stat, MockInit, MockBusName, MockSystemBus, tmp_path
+    ):
+        """
+        Test that rewriting grubenv in place, as grub-reboot does, invalidates the cached `list_images` result.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_stat.side_effect = self._mock_installer_stat()
+        mock_check_output.return_value = b"Current: image1\nNext: image1\nAvailable:\nimage1\nimage2\n"
+        grub_dir = tmp_path / "grub"
+        grub_dir.mkdir()
+        grubenv = grub_dir / "grubenv"
+        grubenv.write_text("next_entry=0\n")
+        os.utime(grubenv, ns=(0, 0))
+        os.utime(grub_dir, ns=(0, 0))
+
+        with mock.patch("host_modules.image_service.HOST_PATH", str(tmp_path)):
+            image_service.list_images()
+            image_service.list_images()
+            assert mock_check_output.call_count == 1, "sonic-installer should not run on a cache hit"
+
+            # Act
+            with open(grubenv, "r+") as f:
+                f.write("next_entry=1\n")
+            os.utime(grub_dir, ns=(0, 0))
+            image_service.list_images()
+
+        # Assert
+        assert mock_check_output.call_count == 2, "sonic-installer should run after grubenv is rewritten"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("os.stat")
+    def test_list_images_cache_key_no_boot_config(self, mock_stat, MockInit, MockBusName, MockSystemBus, tmp_path):
+        """
+        Test that `list_images` results are not cached when the boot configuration is not kept in files under
+        /host, e.g. on U-Boot platforms.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_stat.side_effect = self._mock_installer_stat()
+        (tmp_path / "image-1").mkdir()
+
+        with mock.patch("host_modules.image_service.HOST_PATH", str(tmp_path)):
+            # Act
+            key = image_service._list_images_cache_key()
+
+        # Assert
+        assert key is None, "result should not be cached"
+
+    @mock.patch("dbus.SystemBus")
+    @mock.patch("dbus.service.BusName")
+    @mock.patch("dbus.service.Object.__init__")
+    @mock.patch("subprocess.Popen")
+    @mock.patch("subprocess.check_output")
+    def test_list_images_not_cached_during_install(
+        self, mock_check_output, mock_popen, MockInit, MockBusName, MockSystemBus
+    ):
+        """
+        Test that `list_images` results taken while an image is being installed are not cached.
+        """
+        # Arrange
+        image_service = ImageService(mod_name="image_service")
+        mock_check_output.return_value = b"Current: image1\nNext: image1\nAvailable:\nimage1\n"
+
+        def installer_stderr():
+            image_service.list_images()
+            image_service.list_images()
+            yield "Installing image\n"
+        mock_popen.return_value.stderr = installer_stderr()
+        mock_popen.return_value.wait.return_value = 0
+
+        with mock.patch.object(ImageService, "_list_images_cache_key", return_value="key"):
+            # Act
+            rc, _ = image_service.install("sonic_image.img")
+            image_service.list_images()
+            image_service.list_images()
+
+        # Assert
+        assert rc == 0, "wrong return value"
+        assert mock_check_output.call_count == 3, "listings taken during the install should not be cached"
+
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
@@ -572,18 +1674,18 @@ class TestImageService(object):
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("subprocess.run")
-    def test_image_set_next_boot_success(self, mock_run, MockInit, MockBusName, MockSystemBus):
+    @mock.patch("subprocess.Popen")
+    def test_image_set_next_boot_success(self, mock_popen, MockInit, MockBusName, MockSystemBus):
         """
         Test that the `set_next_boot` method successfully sets the next boot image.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
         image = "sonic_image"
-        mock_result = mock.Mock()
-        mock_result.returncode = 0
-        mock_result.stderr = b""
-        mock_run.return_value = mock_result
+        mock_proc = mock.Mock()
+        mock_proc.returncode = 0
+        mock_proc.communicate.return_value = (None, "")
+        mock_popen.return_value = mock_proc
 
         # Act
         rc, msg = image_service.set_next_boot(image)
@@ -591,27 +1693,28 @@ class TestImageService(object):
         # Assert
         assert rc == 0, "wrong return value"
         assert image in msg, "message should contain the name of the new image"
-        mock_run.assert_called_once_with(
+        mock_popen.assert_called_once_with(
             ["/usr/local/bin/sonic-installer", "set-next-boot", image],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
+            text=True,
         )
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("subprocess.run")
-    def test_image_set_next_boot_fail_not_exists(self, mock_run, MockInit, MockBusName, MockSystemBus):
+    @mock.patch("subprocess.Popen")
+    def test_image_set_next_boot_fail_not_exists(self, mock_popen, MockInit, MockBusName, MockSystemBus):
         """
         Test that the `set_next_boot` method fails when the image does not exist.
         """
         # Arrange
         image_service = ImageService(mod_name="image_service")
         image = "nonexistent_image"
-        mock_result = mock.Mock()
-        mock_result.returncode = errno.ENOENT
-        mock_result.stderr = b"Error: Image does not exist"
-        mock_run.return_value = mock_result
+        mock_proc = mock.Mock()
+        mock_proc.returncode = errno.ENOENT
+        mock_proc.communicate.return_value = (None, "Error: Image does not exist")
+        mock_popen.return_value = mock_proc
 
         # Act
         rc, msg = image_service.set_next_boot(image)
@@ -621,17 +1724,18 @@ class TestImageService(object):
         assert (
             "not" in msg.lower() and ("exist" in msg.lower() or "found" in msg.lower())
         ), "message should contain 'not' and 'exist' or 'found'"
-        mock_run.assert_called_once_with(
+        mock_popen.assert_called_once_with(
             ["/usr/local/bin/sonic-installer", "set-next-boot", image],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
+            text=True,
         )
 
     @mock.patch("dbus.SystemBus")
     @mock.patch("dbus.service.BusName")
     @mock.patch("dbus.service.Object.__init__")
-    @mock.patch("subprocess.run")
-    def test_image_set_next_boot_fail_not_exists_generic_rc(self, mock_run, MockInit, MockBusName, MockSystemBus):
+    @mock.patch("subprocess.Popen")
+    def test_image_set_next_boot_fail_not_exists_generic_rc(self, mock_popen, MockInit, MockBusName, MockSystemBus):
         """
         Test that the `set_next_boot` method fails when the image does not exist, and sonic-installer returns a generic error code
         instead of errno.ENOENT.
@@ -639,10 +1743,10 @@ class TestImageService(object):
         # Arrange
         image_service = ImageService(mod_name="image_service")
         image = "nonexistent_image"
-        mock_result = mock.Mock()
-        mock_result.returncode = 1  # returns generic error code
-        mock_result.stderr = b"Error: Image does not exist"
-        mock_run.return_value = mock_result
+        mock_proc = mock.Mock()
+        mock_proc.returncode = 1  # returns generic error code
+        mock_proc.communicate.return_value = (None, "Error: Image does not exist")
+        mock_popen.return_value = mock_proc
 
         # Act
         rc, msg = image_service.set_next_boot(image)
@@ -652,10 +1756,11 @@ class TestImageService(object):
         assert (
             "not" in msg.lower() and ("exist" in msg.lower() or "found" in msg.lower())
         ), "message should contain 'not' and 'exist' or 'found'"
-        mock_run.assert_called_once_with(
+        mock_popen.assert_called_once_with(
             ["/usr/local/bin/sonic-installer", "set-next-boot", image],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
+            text=True,
         )
 
     @mock.patch("dbus.SystemBus")